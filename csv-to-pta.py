@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 import argparse
+import bisect
 import csv
 import hashlib
+import mmap
 import os
 import sys
 import re
@@ -9,12 +11,45 @@ import unicodedata
 from datetime import datetime
 import logging
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# This pattern matches, in a single pass, everything the cleaner drops:
+# numbers that are not surrounded by letters, punctuation, and whitespace.
+# Runs are grouped so a run containing whitespace collapses to one space.
+_RE_CLEAN = re.compile(r"(?:(?<![a-zA-Z])[0-9]+(?![a-zA-Z])|[^\w\s]|\s)+")
+
+
+# Number of entries to buffer before flushing to the output files
+_WRITE_BATCH = 1024
+
+
+class _AmountTable(dict):
+    # Translation table that deletes everything but digits, '.' and '-'.
+    # Lazily populated so translate() keeps its C-level dict lookups while
+    # covering currency symbols and other non-latin-1 characters.
+    def __missing__(self, code):
+        char = chr(code)
+        keep = code if char.isdigit() or char in ".-" else None
+        self[code] = keep
+        return keep
+
+
+_AMOUNT_KEEP = _AmountTable()
+
+
+def _clean_repl(m):
+    return " " if any(c.isspace() for c in m.group()) else ""
+
 
 def read_existing_hashes(hash_file):
     existing_hashes = set()
     if hash_file and os.path.exists(hash_file):
         with open(hash_file, "r") as f:
-            existing_hashes.update(line.strip() for line in f)
+            # Raw bytes keys are ~3x smaller than their hex strings
+            existing_hashes.update(bytes.fromhex(line.strip()) for line in f)
     return existing_hashes
 
 
@@ -26,8 +61,60 @@ def read_payee(payee_file):
     return sorted(payees, key=lambda x: len(x), reverse=True)
 
 
+def build_payee_automaton(payees):
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    added = False
+    for p in payees:
+        # add_word refuses empty strings and returns False
+        added = automaton.add_word(p, p) or added
+    if not added:
+        # make_automaton on zero words leaves the automaton unusable
+        # and iter() would raise; let the trie fallback handle this run
+        return None
+    automaton.make_automaton()
+    return automaton
+
+
+# Key marking a complete payee in the trie; "" can never be a character
+_TRIE_END = ""
+
+
+def build_payee_trie(payees):
+    # Dict-of-dicts trie used when pyahocorasick is not installed
+    trie = {}
+    for p in payees:
+        node = trie
+        for c in p:
+            node = node.setdefault(c, {})
+        node[_TRIE_END] = p
+    return trie
+
+
+def match_payee_trie(trie, payee):
+    # Longest known payee appearing anywhere in the cleaned string
+    best = ""
+    n = len(payee)
+    for i in range(n):
+        if n - i <= len(best):
+            # No later start can yield a longer match
+            break
+        node = trie
+        for j in range(i, n):
+            node = node.get(payee[j])
+            if node is None:
+                break
+            hit = node.get(_TRIE_END)
+            if hit is not None and len(hit) > len(best):
+                best = hit
+    return best
+
+
 def compute_hash(entry):
-    return hashlib.sha256(entry.encode()).hexdigest()
+    # Deduplication doesn't need cryptographic strength; blake2b is
+    # noticeably faster than sha256 on the short entries hashed here.
+    return hashlib.blake2b(entry, digest_size=16).digest()
 
 
 def main():
@@ -142,121 +229,217 @@ def main():
     # Read files
     existing_hashes = read_existing_hashes(hash_file)
     logging.info(f"found {len(existing_hashes)} existing hashes")
+    # Hash files written before the blake2b switch hold 32-byte sha256
+    # keys; entries must also be checked against those to stay deduped
+    legacy_hashes = any(len(h) == 32 for h in existing_hashes)
     payees = read_payee(payee_file)
     logging.info(f"found {len(payees)} payees")
+    automaton = build_payee_automaton(payees)
+    payee_trie = build_payee_trie(payees) if automaton is None else None
 
     # Convert 1-based indices from user to 0-based for Python
     d_idx = args.date_col - 1
     p_idxs = [idx - 1 for idx in args.payee_col]
     a_idx = args.amount_col - 1
+    # Most setups use a single payee column; skip the join entirely then
+    single_p_idx = p_idxs[0] if len(p_idxs) == 1 else None
+
+    # ISO-like dates can skip strptime and only need a separator swap
+    fast_date_sep = (
+        args.date_format[2] if args.date_format in ("%Y/%m/%d", "%Y-%m-%d") else None
+    )
 
     with (
-        open(args.file, mode="r", encoding=args.encoding) as f,
-        open(ledger_file, "a") as out,
-        open(hash_file, "a") as hash_out,
+        open(args.file, mode="rb") as f,
+        open(ledger_file, "ab", buffering=1024 * 1024) as out,
+        open(hash_file, "ab", buffering=1024 * 1024) as hash_out,
     ):
         if os.path.getsize(ledger_file) == 0:
             # Dump config file at the top of the ledger file
             if os.path.exists(config_file):
-                with open(config_file, "r") as config:
+                with open(config_file, "rb") as config:
                     out.writelines(config.readlines())
 
-        # Read and parse CSV file
-        reader = csv.reader(f, delimiter=args.delim)
+        # Map the CSV instead of copying it into one big Python buffer;
+        # the kernel pages data in lazily and each line is decoded on
+        # demand (readline keeps the terminator, so quoted newlines
+        # survive)
+        if os.path.getsize(args.file) > 0:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if "\n".encode(args.encoding) == b"\n":
+                # ASCII-compatible codec: a 0x0a byte is always a newline,
+                # so each raw line can be decoded independently
+                lines = (
+                    line.decode(args.encoding) for line in iter(mm.readline, b"")
+                )
+            else:
+                # utf-16/utf-32 and friends embed 0x0a inside code units;
+                # decode the whole map before splitting into lines
+                lines = mm[:].decode(args.encoding).splitlines(keepends=True)
+        else:
+            lines = ()
+        reader = csv.reader(lines, delimiter=args.delim)
 
         if args.skip:
             next(reader, None)
 
-        for row_num, row in enumerate(reader, start=1):
-            logging.debug(f"\n--- Row {row_num} ---")
-            logging.debug(f"row: {row}")
-            if not row:
-                logging.warning("Empty row detected.")
-                continue  # Skip empty lines
-
-            if row_num < args.begin:
-                continue
-
-            date = row[d_idx].strip()
-            if not date:
-                logging.warning("Empty date detected.")
-                continue
-
-            try:
-                date_obj = datetime.strptime(date, args.date_format)
-                date = date_obj.strftime("%Y/%m/%d")
-            except ValueError:
-                logging.error(f"Invalid date detected: {date}")
-                exit(1)
-
-            # Concatenate columns for payee description
-            raw_payee = " ".join(row[idx].strip() for idx in p_idxs if idx < len(row))
-            if not raw_payee:
-                logging.error("Empty payee detected.")
-                exit(1)
-
-            if args.clean:
-                logging.debug(f"raw payee: {raw_payee}")
-                payee = raw_payee.lower()
-                # This pattern matches numbers that are not surrounded by letters
-                payee = re.sub(r"(?<![a-zA-Z])[0-9]+(?![a-zA-Z])", "", payee)
-                # This pattern match punctuation
-                payee = re.sub(r"[^\w\s]", "", payee)
-                # This pattern matches multiple spaces
-                payee = re.sub(r"\s+", " ", payee).strip()
-                if args.encoding != "utf-8":
-                    nfkd_form = unicodedata.normalize("NFKD", payee)
-                    payee = "".join(
-                        c for c in nfkd_form if not unicodedata.combining(c)
+        entry_buf = []
+        hash_buf = []
+
+        # Bind hot lookups to locals; saves a dict lookup per reference
+        # per row in the loop below
+        strptime = datetime.strptime
+        clean_sub = _RE_CLEAN.sub
+        add_hash = existing_hashes.add
+        sha256 = hashlib.sha256
+        buffer_entry = entry_buf.append
+        buffer_hash = hash_buf.append
+        debug = logging.debug
+
+        # Flush on every exit path so rows converted before an
+        # error or interrupt are not lost
+        try:
+            for row_num, row in enumerate(reader, start=1):
+                debug("\n--- Row %d ---", row_num)
+                debug("row: %r", row)
+                if not row:
+                    logging.warning("Empty row detected.")
+                    continue  # Skip empty lines
+
+                if row_num < args.begin:
+                    continue
+
+                date = row[d_idx].strip()
+                if not date:
+                    logging.warning("Empty date detected.")
+                    continue
+
+                if (
+                    fast_date_sep
+                    and len(date) == 10
+                    and date[4] == date[7] == fast_date_sep
+                    and date[:4].isdigit()
+                    and date[5:7].isdigit()
+                    and date[8:].isdigit()
+                    and "01" <= date[5:7] <= "12"
+                    # every month has days 01-28; 29-31 go through
+                    # strptime so month-length errors are still caught
+                    and "01" <= date[8:] <= "28"
+                ):
+                    date = date.replace("-", "/")
+                else:
+                    try:
+                        date_obj = strptime(date, args.date_format)
+                        date = date_obj.strftime("%Y/%m/%d")
+                    except ValueError:
+                        logging.error(f"Invalid date detected: {date}")
+                        exit(1)
+
+                # Concatenate columns for payee description
+                if single_p_idx is not None:
+                    raw_payee = (
+                        row[single_p_idx].strip() if single_p_idx < len(row) else ""
                     )
-                logging.debug(f"cleaned payee: {payee}")
-            else:
-                payee = raw_payee
-
-            found = False
-            for p in payees:
-                if p in payee:
-                    payee = p
-                    found = True
-            if not found:
-                logging.warning(f"Payee not found:\n{payee}")
-                payee_input = input("Enter payee: ")
-                if payee_input:
-                    if payee_input in ["quit", "exit", "stop"]:
-                        break
-                    payee = payee_input
-                    payees.append(payee)
-
-            amount = row[a_idx].strip()
-            if args.replace_comma:
-                amount = amount.replace(",", ".")
-                amount = "".join(c for c in amount if c.isdigit() or c in ".-")
-            try:
-                amount = float(amount)
-            except ValueError:
-                logging.error(f"Invalid amount detected: {amount}")
-                exit(1)
-
-            print(f"Date: {date} | Payee: {payee} | Amount: {amount}")
-
-            entry = (
-                f"{date} {payee}\n\t{args.account}  {amount}\n\tExpenses:Unknown\n\n"
-            )
-
-            # Compute hash for the entry
-            entry_hash = compute_hash(entry)
-
-            # Check if entry already exists
-            if entry_hash in existing_hashes:
-                print("Info: Entry already exists. Skipping.")
-                continue
-
-            out.write(entry)
-            hash_out.write(f"{entry_hash}\n")
-            existing_hashes.add(entry_hash)
-
+                else:
+                    raw_payee = " ".join(
+                        [row[idx].strip() for idx in p_idxs if idx < len(row)]
+                    )
+                if not raw_payee:
+                    logging.error("Empty payee detected.")
+                    exit(1)
+
+                if args.clean:
+                    debug("raw payee: %s", raw_payee)
+                    # Pure ASCII payees (the common case) have no combining
+                    # marks, so normalization would be two wasted passes
+                    if args.encoding != "utf-8" and not raw_payee.isascii():
+                        # Case-fold and strip combining marks in one decompose pass
+                        payee = "".join(
+                            c
+                            for c in unicodedata.normalize("NFKD", raw_payee.casefold())
+                            if not unicodedata.combining(c)
+                        )
+                    else:
+                        payee = raw_payee.lower()
+                    payee = clean_sub(_clean_repl, payee).strip()
+                    debug("cleaned payee: %s", payee)
+                else:
+                    payee = raw_payee
+
+                found = False
+                if automaton is not None:
+                    # Single pass over the payee, keeping the longest known match
+                    best = ""
+                    for _, p in automaton.iter(payee):
+                        if len(p) > len(best):
+                            best = p
+                    if best:
+                        payee = best
+                        found = True
+                else:
+                    best = match_payee_trie(payee_trie, payee)
+                    if best:
+                        payee = best
+                        found = True
+                if not found:
+                    logging.warning(f"Payee not found:\n{payee}")
+                    payee_input = input("Enter payee: ")
+                    if payee_input:
+                        if payee_input in ["quit", "exit", "stop"]:
+                            break
+                        payee = payee_input
+                        # Keep the longest-first invariant from read_payee
+                        bisect.insort(payees, payee, key=lambda x: -len(x))
+                        if automaton is not None:
+                            automaton = build_payee_automaton(payees)
+                        else:
+                            payee_trie = build_payee_trie(payees)
+
+                amount = row[a_idx].strip()
+                if args.replace_comma:
+                    amount = amount.replace(",", ".").translate(_AMOUNT_KEEP)
+                # Validate only; keeping the string preserves the exact cents
+                # (float would turn 1.10 into 1.1) and skips re-stringifying
+                try:
+                    float(amount)
+                except ValueError:
+                    logging.error(f"Invalid amount detected: {amount}")
+                    exit(1)
+
+                print(f"Date: {date} | Payee: {payee} | Amount: {amount}")
+
+                # Encode once: the same bytes are hashed and written out
+                entry = (
+                    f"{date} {payee}\n\t{args.account}  {amount}\n\tExpenses:Unknown\n\n"
+                ).encode()
+
+                # Compute hash for the entry
+                entry_hash = compute_hash(entry)
+
+                # Check if entry already exists, including under the old
+                # sha256 scheme (same UTF-8 bytes were hashed back then)
+                if entry_hash in existing_hashes or (
+                    legacy_hashes and sha256(entry).digest() in existing_hashes
+                ):
+                    print("Info: Entry already exists. Skipping.")
+                    continue
+
+                buffer_entry(entry)
+                buffer_hash(entry_hash.hex().encode() + b"\n")
+                add_hash(entry_hash)
+
+                if len(entry_buf) >= _WRITE_BATCH:
+                    out.writelines(entry_buf)
+                    entry_buf.clear()
+                    hash_out.writelines(hash_buf)
+                    hash_buf.clear()
+        finally:
+            out.writelines(entry_buf)
+            hash_out.writelines(hash_buf)
+
+    # payees is kept sorted longest-first throughout the run
     with open(payee_file, "w") as f:
-        for payee in sorted(payees, key=lambda x: len(x), reverse=True):
+        for payee in payees:
             f.write(f"{payee}\n")
 
 